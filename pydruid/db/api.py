@@ -1,16 +1,46 @@
 import asyncio
+import csv
 import functools
+import io
 import itertools
+import queue
+import re
+import threading
 import warnings
+import weakref
 from base64 import b64encode
 from collections import namedtuple
 from urllib import parse
+from urllib.request import getproxies, proxy_bypass
 
-import requests
-from ujson import loads as ujson_loads
+import urllib3
+from urllib3.util.request import ACCEPT_ENCODING
 
 from pydruid.db import exceptions
 
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from ujson import dumps as json_dumps, loads as json_loads
+
+# Result lines are handed to the JSON parser in batches, flushed when either
+# limit is reached, so the per-call overhead is paid once per batch.
+BATCH_MAX_ROWS = 256
+BATCH_MAX_BYTES = 64 * 1024
+
+# Size of the blocks read from the response body.
+READ_CHUNK_SIZE = 64 * 1024
+
+# Connections kept alive per host by the connection pools.
+POOL_MAXSIZE = 10
+
+# Result formats supported by the cursors.
+RESULT_FORMATS = ("arrayLines", "csv")
+
+# `%(name)s` placeholders and `%%` escapes, the subset of `%` formatting
+# supported by the `pyformat` paramstyle.
+PARAMETER_PATTERN = re.compile(r"%(?:\(([^)]+)\)s|%)")
+
 
 class Type(object):
     STRING = 1
@@ -31,6 +61,9 @@ def connect(
     ssl_client_cert=None,
     proxies=None,
     timeout=None,
+    use_namedtuples=True,
+    prefetch=0,
+    result_format="arrayLines",
 ):  # noqa: E125
     """
     Constructor for creating a connection to the database.
@@ -54,9 +87,73 @@ def connect(
         ssl_client_cert,
         proxies,
         timeout,
+        use_namedtuples,
+        prefetch,
+        result_format,
     )
 
 
+def _create_pool(url, ssl_verify_cert, ssl_client_cert, proxies, timeout):
+    """
+    Create a pool of HTTP connections.
+
+    The SSL, proxy and timeout arguments have the same meaning as in
+    `requests`. Without proxies, the ones from the environment are used; they
+    are looked up once here rather than on every request.
+    """
+    if isinstance(ssl_client_cert, str):
+        cert_file, key_file = ssl_client_cert, None
+    else:
+        cert_file, key_file = ssl_client_cert or (None, None)
+
+    if isinstance(timeout, tuple):
+        connect_timeout, read_timeout = timeout
+    else:
+        connect_timeout = read_timeout = timeout
+
+    kwargs = {
+        "cert_reqs": "CERT_REQUIRED" if ssl_verify_cert else "CERT_NONE",
+        "ca_certs": ssl_verify_cert if isinstance(ssl_verify_cert, str) else None,
+        "cert_file": cert_file,
+        "key_file": key_file,
+        "timeout": urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+        # queries are not idempotent in general, never send them twice
+        "retries": False,
+        # connections kept alive per host, for cursors used from several
+        # threads; the same as the default of `requests`
+        "maxsize": POOL_MAXSIZE,
+    }
+
+    if proxies is None:
+        host = parse.urlsplit(url).hostname
+        proxy = None if proxy_bypass(host) else _select_proxy(getproxies(), url)
+    else:
+        proxy = _select_proxy(proxies, url)
+
+    if proxy is None:
+        return urllib3.PoolManager(**kwargs)
+
+    auth = urllib3.util.parse_url(proxy).auth
+    return urllib3.ProxyManager(
+        proxy,
+        proxy_headers=urllib3.make_headers(proxy_basic_auth=auth) if auth else None,
+        **kwargs,
+    )
+
+
+def _select_proxy(proxies, url):
+    """Pick the proxy for `url` from a `requests` or HTTPX style mapping."""
+    if proxies is None or isinstance(proxies, str):
+        return proxies
+
+    scheme = parse.urlsplit(url).scheme
+    for key in (scheme, scheme + "://", "all", "all://"):
+        if key in proxies:
+            return proxies[key]
+
+    return None
+
+
 def check_closed(f):
     """Decorator that checks if connection/cursor is closed."""
 
@@ -103,6 +200,17 @@ def check_result(f):
     return functools.wraps(f)(g)
 
 
+@functools.lru_cache(maxsize=128)
+def _row_class(field_names):
+    """
+    Return the namedtuple class for rows with the given columns.
+
+    Creating a namedtuple class is slow, so classes are reused by queries
+    returning the same columns.
+    """
+    return namedtuple("Row", field_names, rename=True)
+
+
 def get_description_from_row(row):
     """
     Return description from a single row.
@@ -111,33 +219,49 @@ def get_description_from_row(row):
     can be NULL. String columns in Druid are NULLable. Numeric columns are NOT
     NULL.
     """
-    return [
-        (
-            name,  # name
-            get_type(value),  # type_code
-            None,  # [display_size]
-            None,  # [internal_size]
-            None,  # [precision]
-            None,  # [scale]
-            get_type(value) == Type.STRING,  # [null_ok]
+    description = []
+    for name, value in row.items():
+        type_code = get_type(value)
+        description.append(
+            (
+                name,  # name
+                type_code,  # type_code
+                None,  # [display_size]
+                None,  # [internal_size]
+                None,  # [precision]
+                None,  # [scale]
+                type_code == Type.STRING,  # [null_ok]
+            )
         )
-        for name, value in row.items()
-    ]
+
+    return description
+
+
+# Type codes by Python type. Note that bool is a subclass of int so the order
+# matters when matching subclasses.
+TYPE_CODES = {
+    str: Type.STRING,
+    type(None): Type.STRING,
+    bool: Type.BOOLEAN,
+    int: Type.NUMBER,
+    float: Type.NUMBER,
+}
 
 
 def get_type(value):
     """
     Infer type from value.
 
-    Note that bool is a subclass of int so order of statements matter.
+    The exact type of the value is looked up first, subclasses of the known
+    types are matched with `isinstance`.
     """
+    type_code = TYPE_CODES.get(type(value))
+    if type_code is not None:
+        return type_code
 
-    if isinstance(value, str) or value is None:
-        return Type.STRING
-    elif isinstance(value, bool):
-        return Type.BOOLEAN
-    elif isinstance(value, (int, float)):
-        return Type.NUMBER
+    for type_, type_code in TYPE_CODES.items():
+        if isinstance(value, type_):
+            return type_code
 
     raise exceptions.Error("Value of unknown type: {value}".format(value=value))
 
@@ -157,6 +281,9 @@ class BaseConnection(object):
         ssl_client_cert=None,
         proxies=None,
         timeout=None,
+        use_namedtuples=True,
+        prefetch=0,
+        result_format="arrayLines",
     ):
         netloc = "{host}:{port}".format(host=host, port=port)
         self.url = parse.urlunparse((scheme, netloc, path, None, None, None))
@@ -170,6 +297,9 @@ class BaseConnection(object):
         self.ssl_client_cert = ssl_client_cert
         self.proxies = proxies
         self.timeout = timeout
+        self.use_namedtuples = use_namedtuples
+        self.prefetch = prefetch
+        self.result_format = result_format
 
     @check_closed
     def close(self):
@@ -209,6 +339,24 @@ class BaseConnection(object):
 class Connection(BaseConnection):
     """Connection to a Druid database."""
 
+    def __init__(self, *args, **kwargs):
+        super(Connection, self).__init__(*args, **kwargs)
+
+        # shared by all the cursors so that HTTP connections are kept alive
+        # between queries
+        self.session = _create_pool(
+            self.url,
+            self.ssl_verify_cert,
+            self.ssl_client_cert,
+            self.proxies,
+            self.timeout,
+        )
+
+    @check_closed
+    def close(self):
+        super(Connection, self).close()
+        self.session.clear()
+
     @check_closed
     def cursor(self):
         cursor = Cursor(
@@ -218,9 +366,13 @@ class Connection(BaseConnection):
             self.context,
             self.header,
             self.ssl_verify_cert,
-            self.ssl_client_cert,
-            self.proxies,
-            self.timeout,
+            proxies=self.proxies,
+            ssl_client_cert=self.ssl_client_cert,
+            timeout=self.timeout,
+            use_namedtuples=self.use_namedtuples,
+            prefetch=self.prefetch,
+            result_format=self.result_format,
+            session=self.session,
         )
 
         self.cursors.append(cursor)
@@ -233,6 +385,21 @@ class Connection(BaseConnection):
         return cursor.execute(operation, parameters)
 
 
+class ResultState(object):
+    """The state of reading the results of a query."""
+
+    def __init__(self, result_format):
+        # the format the results were requested in
+        self.result_format = result_format
+
+        # number of rows read so far, and whether all of them were read
+        self.row_count = 0
+        self.exhausted = False
+
+        # per column converters of `csv` results
+        self.converters = None
+
+
 class BaseCursor(object):
     def __init__(
         self,
@@ -245,6 +412,10 @@ class BaseCursor(object):
         proxies=None,
         ssl_client_cert=None,
         timeout=None,
+        use_namedtuples=True,
+        prefetch=0,
+        result_format="arrayLines",
+        session=None,
     ):
         if header is not None and not header:
             warnings.warn(
@@ -261,6 +432,24 @@ class BaseCursor(object):
         self.proxies = proxies
         self.timeout = timeout
 
+        # Rows are returned as namedtuples by default; plain tuples are
+        # cheaper to build when callers only access columns by position.
+        self.use_namedtuples = use_namedtuples
+
+        # Number of rows to buffer ahead of the caller in the background while
+        # it processes the current ones, handed over in batches of up to 256
+        # rows. Disabled when 0.
+        self.prefetch = prefetch
+
+        # Druid result format, either `arrayLines` or `csv`. The values of
+        # `csv` results are converted according to the SQL types of their
+        # columns.
+        self.result_format = result_format
+
+        # HTTP session owned by the connection, if any: a `urllib3` pool
+        # manager for `Cursor` and an `aiohttp` session for `AsyncCursor`
+        self.session = session
+
         # This read/write attribute specifies the number of rows to fetch at a
         # time with .fetchmany(). It defaults to 1 meaning to fetch a single
         # row at a time.
@@ -274,6 +463,12 @@ class BaseCursor(object):
         # this is set to an iterator after a successfull query
         self._results = None
 
+        # state of the results of the last query; the generators of earlier
+        # queries, which may still be read by a prefetcher, keep their own
+        self._state = ResultState(result_format)
+
+        self._build_request_parts()
+
     @check_closed
     def close(self):
         """Close the cursor."""
@@ -283,7 +478,6 @@ class BaseCursor(object):
     @check_result
     @check_closed
     def rowcount(self):
-        # consume the iterator
         raise NotImplementedError("Subclasses must implement this method")
 
     @check_closed
@@ -325,6 +519,15 @@ class BaseCursor(object):
         """
         raise NotImplementedError("Subclasses must implement this method")
 
+    @check_result
+    @check_closed
+    def fetch_arrow(self):
+        """
+        Fetch all (remaining) rows of a query result, returning them as a
+        `pyarrow.Table`. Requires pyarrow.
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
     @check_closed
     def setinputsizes(self, sizes):
         # not supported
@@ -335,40 +538,64 @@ class BaseCursor(object):
         # not supported
         pass
 
-    def _stream_query(self, query):
+    def _open_stream(self, query):
         """
-        Stream rows from a query.
+        Send a query and read the header of its results.
 
-        This method will yield rows as the data is returned from the server.
+        The rest of the response is then streamed by `_iter_rows`, which will
+        yield rows as the data is returned from the server.
         """
         raise NotImplementedError("Subclasses must implement this method")
 
-    def _prepare_headers_and_payload(self, query):
-        headers = {"Content-Type": "application/json"}
+    def _build_request_parts(self):
+        """Build the parts of the request that do not depend on the query."""
+        if self.result_format not in RESULT_FORMATS:
+            raise exceptions.NotSupportedError(
+                "Unsupported result format: {}".format(self.result_format)
+            )
 
-        payload = {
-            "query": query,
+        self._authorization = None
+        if self.user is not None:
+            authstring = "{}:{}".format(self.user, self.password)
+            b64string = b64encode(authstring.encode()).decode()
+            self._authorization = "Basic {}".format(b64string)
+
+        self._base_payload = {
             "context": self.context,
             "header": True,
-            "resultFormat": "arrayLines",
+            "resultFormat": self.result_format,
         }
+        if self.result_format == "csv":
+            self._base_payload["sqlTypesHeader"] = True
 
-        if self.user is not None:
-            authstring = "{}:{}".format(self.user, self.password)
-            b64string = b64encode(authstring.encode()).decode()
-            headers["Authorization"] = "Basic {}".format(b64string)
+        self._request_attributes = (self.user, self.password, self.result_format)
+
+    def _prepare_headers_and_payload(self, query):
+        # the attributes the parts were built from may have been reassigned
+        # since; the context is compared by identity, as the payload refers
+        # to the same dict
+        if self.context is not self._base_payload["context"] or (
+            self._request_attributes != (self.user, self.password, self.result_format)
+        ):
+            self._build_request_parts()
+
+        headers = {"Content-Type": "application/json"}
+        if self._authorization is not None:
+            headers["Authorization"] = self._authorization
+
+        payload = {"query": query, **self._base_payload}
 
         return headers, payload
 
     @staticmethod
-    def _handle_http_error(response):
+    def _handle_http_error(body):
         try:
-            payload = response.json()
+            payload = json_loads(body)
         except Exception:
             payload = {
                 "error": "Unknown error",
                 "errorClass": "Unknown",
-                "errorMessage": response.text,
+                "errorMessage": body,
             }
         if "errorClass" not in payload and "errorCode" in payload:
             payload["errorClass"] = payload["errorCode"]
@@ -378,6 +605,64 @@ class BaseCursor(object):
     def _set_description(self, field_names):
         self.description = [(name, None) for name in field_names]
 
+    def _get_row_factory(self, field_names):
+        if self.use_namedtuples:
+            # what `Row._make` does, minus a Python level call and a length
+            # check per row; Druid rows always match the header
+            return functools.partial(tuple.__new__, _row_class(tuple(field_names)))
+
+        return tuple
+
+    def _parse_header(self, line):
+        if self._state.result_format == "csv":
+            return next(csv.reader([line.decode("utf-8")]))
+
+        return json_loads(line)
+
+    @staticmethod
+    def _get_converters(sql_types):
+        return [CSV_CONVERTERS.get(sql_type, str) for sql_type in sql_types]
+
+    def _to_arrow(self, rows):
+        """Build a `pyarrow.Table` from rows, one contiguous array per column."""
+        import pyarrow
+
+        names = [name for name, _ in self.description]
+        columns = zip(*rows) if rows else [[] for _ in names]
+        converters = self._state.converters
+        if converters is None:
+            types = [None for _ in names]
+        else:
+            types = [
+                pyarrow.type_for_alias(ARROW_TYPES[convert]) for convert in converters
+            ]
+
+        return pyarrow.Table.from_arrays(
+            [
+                pyarrow.array(column, type=type_)
+                for column, type_ in zip(columns, types)
+            ],
+            names=names,
+        )
+
+    @staticmethod
+    def _parse_lines(lines, state):
+        """Parse a batch of rows with a single parser call."""
+        if not lines:
+            return []
+
+        if state.converters is None:
+            rows = json_loads(b"[" + b",".join(lines) + b"]")
+        else:
+            text = b"\n".join(lines).decode("utf-8")
+            rows = [
+                [convert(value) for convert, value in zip(state.converters, values)]
+                for values in csv.reader(io.StringIO(text, newline=""))
+            ]
+        state.row_count += len(rows)
+
+        return rows
+
 
 class Cursor(BaseCursor):
     """Connection cursor."""
@@ -386,21 +671,23 @@ class Cursor(BaseCursor):
     @check_result
     @check_closed
     def rowcount(self):
-        # consume the iterator
-        results = list(self._results)
-        n = len(results)
-        self._results = iter(results)
-        return n
+        # the number of rows is only known once all of them were read
+        state = self._state
+        return state.row_count if state.exhausted else -1
 
     @check_closed
     def execute(self, operation, parameters=None):
         query = apply_parameters(operation, parameters)
-        results = self._stream_query(query)
 
-        # `_stream_query` returns a generator that produces the rows.
-        # We need to consume it once so the query is executed and the
-        # `description` is properly set.
-        next(results)
+        self.description = None
+        lines, field_names = self._open_stream(query)
+        self._set_description(field_names)
+        results = self._iter_rows(
+            lines, self._get_row_factory(field_names), self._state
+        )
+
+        if self.prefetch:
+            results = prefetch_rows(results, self.prefetch)
 
         self._results = results
 
@@ -409,10 +696,7 @@ class Cursor(BaseCursor):
     @check_result
     @check_closed
     def fetchone(self):
-        try:
-            return self.next()
-        except StopIteration:
-            return None
+        return next(self._results, None)
 
     @check_result
     @check_closed
@@ -425,6 +709,11 @@ class Cursor(BaseCursor):
     def fetchall(self):
         return list(self._results)
 
+    @check_result
+    @check_closed
+    def fetch_arrow(self):
+        return self._to_arrow(list(self._results))
+
     @check_result
     @check_closed
     def __next__(self):
@@ -432,72 +721,290 @@ class Cursor(BaseCursor):
 
     next = __next__
 
+    @check_result
     @check_closed
     def __iter__(self):
-        return self
-
-    def _stream_query(self, query):
-        self.description = None
+        # Iterate the results generator directly so that the checks above
+        # run once per loop instead of once per row.
+        return self._results
 
+    def _open_stream(self, query):
         headers, payload = self._prepare_headers_and_payload(query)
+        self._state = ResultState(payload["resultFormat"])
+
+        headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+        if self.session is None:
+            # kept for the next queries of this cursor
+            self.session = _create_pool(
+                self.url,
+                self.ssl_verify_cert,
+                self.ssl_client_cert,
+                self.proxies,
+                self.timeout,
+            )
 
-        r = requests.post(
-            self.url,
-            stream=True,
-            headers=headers,
-            json=payload,
-            verify=self.ssl_verify_cert,
-            cert=self.ssl_client_cert,
-            proxies=self.proxies,
-            timeout=self.timeout,
-        )
-        if r.encoding is None:
-            r.encoding = "utf-8"
-        # raise any error messages
-        if r.status_code != 200:
-            self._handle_http_error(r)
+        try:
+            r = self.session.request(
+                "POST",
+                self.url,
+                body=json_dumps(payload),
+                headers=headers,
+                preload_content=False,
+            )
+            # raise any error messages
+            if r.status != 200:
+                self._handle_http_error(r.data.decode("utf-8", "replace"))
+        except urllib3.exceptions.HTTPError as ex:
+            raise exceptions.OperationalError(str(ex)) from ex
+
+        lines = self._iter_lines(r)
+
+        # an empty response has no columns, and is reported as truncated once
+        # the rows are read
+        field_names = self._parse_header(next(lines, b"[]"))
+        if self._state.result_format == "csv":
+            self._state.converters = self._get_converters(
+                self._parse_header(next(lines, b""))
+            )
 
-        # Druid will stream the data in chunks of 8k bytes
-        # setting `chunk_size` to `None` makes it use the server size
-        lines = r.iter_lines(chunk_size=None, decode_unicode=False)
+        return lines, field_names
 
-        field_names = ujson_loads(next(lines))
-        Row = namedtuple("Row", field_names, rename=True)
-        make_row = Row._make
+    def _iter_rows(self, lines, make_row, state):
+        # `csv` values may contain newlines, so lines inside quotes are
+        # neither a trailer nor the end of a batch
+        count_quotes = state.result_format == "csv"
+        in_quotes = False
 
-        yield self._set_description(field_names)
+        # `csv` writes a single empty value as a blank line too, so a blank
+        # line is only the trailer when it is the last one
+        trailer = False
 
+        batch = []
+        batch_size = 0
         for row in lines:
-            if not row:
+            if trailer:
+                # the blank line was an empty value, quoted for the parser
+                trailer = False
+                batch.append(b'""')
+                batch_size += 2
+            if not row and not in_quotes:
+                trailer = True
+                if count_quotes:
+                    continue
                 break
 
-            yield make_row(ujson_loads(row))
-        else:
+            batch.append(row)
+            batch_size += len(row)
+            if count_quotes and row.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if in_quotes:
+                continue
+
+            if len(batch) >= BATCH_MAX_ROWS or batch_size >= BATCH_MAX_BYTES:
+                yield from map(make_row, self._parse_lines(batch, state))
+                batch = []
+                batch_size = 0
+
+        yield from map(make_row, self._parse_lines(batch, state))
+        if not trailer:
             raise ValueError("Truncated response. Trailer line not found.")
 
+        # read up to the end of the body, so that the connection goes back to
+        # the pool
+        for _ in lines:
+            pass
+        state.exhausted = True
+
+    @staticmethod
+    def _iter_lines(response, chunk_size=READ_CHUNK_SIZE):
+        """
+        Split the response body into lines.
+
+        Unlike `requests`' `iter_lines`, this keeps a single buffer and scans it
+        for newlines with `bytearray.find`, instead of splitting and
+        concatenating every chunk. The connection is closed if the lines are
+        not read to the end.
+        """
+        buf = bytearray()
+        try:
+            for chunk in response.stream(chunk_size, decode_content=True):
+                # only the new data can hold a newline, which matters for lines
+                # longer than a chunk
+                pos = len(buf)
+                buf += chunk
+                start = 0
+                # slicing the view copies each line once, while slicing the
+                # buffer would copy it into a bytearray first; the view must
+                # be released before the buffer is resized
+                with memoryview(buf) as view:
+                    while True:
+                        end = buf.find(b"\n", pos)
+                        if end == -1:
+                            break
+
+                        yield view[start:end].tobytes()
+                        pos = start = end + 1
+
+                del buf[:start]
+
+            if buf:
+                yield bytes(buf)
+        except urllib3.exceptions.HTTPError as ex:
+            raise exceptions.OperationalError(str(ex)) from ex
+        finally:
+            # a no-op once the body was read, since the connection was already
+            # released to the pool
+            response.close()
+
+
+def to_int(value):
+    return int(value) if value else None
+
+
+def to_float(value):
+    return float(value) if value else None
+
+
+def to_bool(value):
+    return value in ("true", "1") if value else None
+
+
+# Converters for the values of `csv` results by SQL type. Values of other types
+# are returned as strings.
+CSV_CONVERTERS = {
+    "TINYINT": to_int,
+    "SMALLINT": to_int,
+    "INTEGER": to_int,
+    "BIGINT": to_int,
+    "FLOAT": to_float,
+    "REAL": to_float,
+    "DOUBLE": to_float,
+    "DECIMAL": to_float,
+    "BOOLEAN": to_bool,
+}
+
+
+# Arrow types of the columns of `csv` results by converter.
+ARROW_TYPES = {to_int: "int64", to_float: "float64", to_bool: "bool", str: "string"}
+
+
+def prefetch_rows(rows, size):
+    """
+    Consume `rows` in a background thread, buffering up to `size` rows.
+
+    Rows are handed over to the caller in batches of up to `BATCH_MAX_ROWS`,
+    and no larger than `size`, to keep the locking overhead of the queue low.
+    The thread stops when the returned generator is closed or garbage
+    collected.
+    """
+    batch_size = min(BATCH_MAX_ROWS, size)
+    batches = queue.Queue(maxsize=size // batch_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch or not put(batch):
+                    break
+        except Exception as ex:
+            put(ex)
+        else:
+            put(None)
+        finally:
+            rows.close()
+
+    def consume():
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+
+                yield from batch
+        finally:
+            stop.set()
+
+    threading.Thread(target=produce, daemon=True).start()
+
+    results = consume()
+    # stop the thread even if the results are never iterated
+    weakref.finalize(results, stop.set)
+
+    return results
+
 
 def apply_parameters(operation, parameters):
     if not parameters:
         return operation
 
-    escaped_parameters = {key: escape(value) for key, value in parameters.items()}
-    return operation % escaped_parameters
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            return "%"
+
+        return escape(parameters[name])
+
+    # only the parameters referenced by the operation are escaped
+    return PARAMETER_PATTERN.sub(replace, operation)
 
 
 def escape(value):
     """
     Escape the parameter value.
 
-    Note that bool is a subclass of int so order of statements matter.
+    The exact type of the value is looked up first, subclasses of the known
+    types are matched with `isinstance`.
     """
+    escape_value = ESCAPE_FUNCTIONS.get(type(value))
+    if escape_value is None:
+        escape_value = next(
+            (
+                function
+                for type_, function in ESCAPE_FUNCTIONS.items()
+                if isinstance(value, type_)
+            ),
+            str,
+        )
 
+    return escape_value(value)
+
+
+def escape_string(value):
     if value == "*":
         return value
-    elif isinstance(value, str):
-        return "'{}'".format(value.replace("'", "''"))
-    elif isinstance(value, bool):
-        return "TRUE" if value else "FALSE"
-    elif isinstance(value, (int, float)):
-        return value
-    elif isinstance(value, (list, tuple)):
-        return ", ".join(escape(element) for element in value)
+
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def escape_boolean(value):
+    return "TRUE" if value else "FALSE"
+
+
+def escape_sequence(value):
+    return ", ".join(map(escape, value))
+
+
+# Escape functions by Python type. Note that bool is a subclass of int so the
+# order matters when matching subclasses.
+ESCAPE_FUNCTIONS = {
+    str: escape_string,
+    bool: escape_boolean,
+    int: str,
+    float: str,
+    list: escape_sequence,
+    tuple: escape_sequence,
+}
@@ -1,19 +1,25 @@
-from collections import namedtuple
-
-from ujson import loads as ujson_loads
+import asyncio
+import contextlib
+import ssl
+import weakref
 
+from pydruid.db import exceptions
 from pydruid.db.api import (
+    _select_proxy,
     apply_parameters,
     BaseConnection,
     BaseCursor,
+    BATCH_MAX_BYTES,
+    BATCH_MAX_ROWS,
     check_closed,
     check_result,
+    ResultState,
 )
 
 try:
-    import httpx
+    import aiohttp
 except ImportError:
-    print("Warning: unable to import HTTPX. The asynchronous api will not work.")
+    print("Warning: unable to import aiohttp. The asynchronous api will not work.")
 
 
 def async_connect(
@@ -29,6 +35,9 @@ def async_connect(
     ssl_client_cert=None,
     proxies=None,
     timeout=None,
+    use_namedtuples=True,
+    prefetch=0,
+    result_format="arrayLines",
 ):  # noqa: E125
     """
     Constructor for creating an async connection to the database.
@@ -52,14 +61,154 @@ def async_connect(
         ssl_client_cert,
         proxies,
         timeout,
+        use_namedtuples,
+        prefetch,
+        result_format,
     )
 
 
+def _create_session(ssl_verify_cert, ssl_client_cert, proxies, timeout):
+    """
+    Create an HTTP session.
+
+    The SSL, proxy and timeout arguments have the same meaning as in
+    `requests`. Proxies are picked per request; without explicit ones, those
+    of the environment are used, as `requests` does.
+    """
+    if isinstance(timeout, tuple):
+        connect_timeout, read_timeout = timeout
+    else:
+        connect_timeout = read_timeout = timeout
+
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            ssl=_create_ssl_context(ssl_verify_cert, ssl_client_cert)
+        ),
+        timeout=aiohttp.ClientTimeout(
+            total=None, connect=connect_timeout, sock_read=read_timeout
+        ),
+        trust_env=proxies is None,
+    )
+
+
+def _create_ssl_context(ssl_verify_cert, ssl_client_cert):
+    # an explicit context is always returned, since older aiohttp versions
+    # skip the verification when given `ssl=True`
+    if isinstance(ssl_verify_cert, str):
+        context = ssl.create_default_context(cafile=ssl_verify_cert)
+    else:
+        context = ssl.create_default_context()
+        if not ssl_verify_cert:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+
+    if isinstance(ssl_client_cert, str):
+        context.load_cert_chain(ssl_client_cert)
+    elif ssl_client_cert is not None:
+        context.load_cert_chain(*ssl_client_cert)
+
+    return context
+
+
+async def _anext(iterator, default):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return default
+
+
+def prefetch_rows(rows, size):
+    """
+    Consume `rows` in a background task, buffering up to `size` rows.
+
+    Rows are handed over to the caller in batches of up to `BATCH_MAX_ROWS`,
+    and no larger than `size`, to keep the overhead of the queue low. The task
+    is cancelled when the returned generator is closed or garbage collected.
+    """
+    batch_size = min(BATCH_MAX_ROWS, size)
+    batches = asyncio.Queue(maxsize=size // batch_size)
+    closed = False
+
+    async def produce():
+        try:
+            batch = []
+            async for row in rows:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    await batches.put(batch)
+                    batch = []
+        except asyncio.CancelledError:
+            # an `Exception` before Python 3.8
+            raise
+        except Exception as ex:
+            # with nobody left to take it, putting the error could block
+            if not closed:
+                await batches.put(ex)
+        else:
+            if batch:
+                await batches.put(batch)
+            await batches.put(None)
+        finally:
+            await rows.aclose()
+
+    async def consume():
+        nonlocal closed
+        try:
+            while True:
+                batch = await batches.get()
+                if batch is None:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+
+                for row in batch:
+                    yield row
+        finally:
+            closed = True
+            task.cancel()
+
+    task = asyncio.ensure_future(produce())
+    results = consume()
+    # cancel the task even if the results are never iterated
+    weakref.finalize(results, task.cancel)
+
+    return results
+
+
 class AsyncConnection(BaseConnection):
     """Async connection to a Druid database."""
 
+    def __init__(self, *args, **kwargs):
+        super(AsyncConnection, self).__init__(*args, **kwargs)
+
+        # shared by all the cursors so that HTTP connections are kept alive
+        # between queries; created on first use
+        self.session = None
+
+    @check_closed
+    async def close(self):
+        """Close the connection now."""
+        self.closed = True
+        for cursor in self.cursors:
+            try:
+                await cursor.close()
+            except exceptions.Error:
+                pass  # already closed
+        if self.session is not None:
+            await self.session.close()
+
     @check_closed
     def cursor(self):
+        """
+        Return a new cursor Object using the connection.
+
+        This must be called with the event loop running.
+        """
+        if self.session is None:
+            self.session = _create_session(
+                self.ssl_verify_cert, self.ssl_client_cert, self.proxies, self.timeout
+            )
+
         cursor = AsyncCursor(
             self.url,
             self.user,
@@ -67,9 +216,13 @@ class AsyncConnection(BaseConnection):
             self.context,
             self.header,
             self.ssl_verify_cert,
-            self.ssl_client_cert,
-            self.proxies,
-            self.timeout,
+            proxies=self.proxies,
+            ssl_client_cert=self.ssl_client_cert,
+            timeout=self.timeout,
+            use_namedtuples=self.use_namedtuples,
+            prefetch=self.prefetch,
+            result_format=self.result_format,
+            session=self.session,
         )
 
         self.cursors.append(cursor)
@@ -81,34 +234,57 @@ class AsyncConnection(BaseConnection):
         cursor = self.cursor()
         return await cursor.execute(operation, parameters)
 
+    def __enter__(self):
+        # closing the connection must be awaited
+        raise TypeError("Use `async with` with an AsyncConnection")
+
+    async def __aenter__(self):
+        return self.cursor()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
 
 class AsyncCursor(BaseCursor):
     """AsyncConnection cursor."""
 
+    def __init__(self, *args, **kwargs):
+        super(AsyncCursor, self).__init__(*args, **kwargs)
+
+        # without a connection, the cursor creates its own session on first
+        # use, and closes it with the cursor
+        self._own_session = None
+
+    @check_closed
+    async def close(self):
+        """Close the cursor."""
+        self.closed = True
+        if self._results is not None:
+            await self._results.aclose()
+        if self._own_session is not None:
+            await self._own_session.close()
+
     @property
     @check_result
     @check_closed
     async def rowcount(self):
-        # consume the iterator
-        results = await self.fetchall()
-        n = len(results)
-
-        async def _aiter():
-            for row in results:
-                yield row
-
-        self._results = _aiter()
-        return n
+        # the number of rows is only known once all of them were read
+        state = self._state
+        return state.row_count if state.exhausted else -1
 
     @check_closed
     async def execute(self, operation, parameters=None):
         query = apply_parameters(operation, parameters)
-        results = self._stream_query(query)
 
-        # `_stream_query` returns a generator that produces the rows.
-        # We need to consume it once so the query is executed and the
-        # `description` is properly set.
-        await results.__anext__()
+        self.description = None
+        stack, lines, field_names = await self._open_stream(query)
+        self._set_description(field_names)
+        results = self._iter_rows(
+            stack, lines, self._get_row_factory(field_names), self._state
+        )
+
+        if self.prefetch:
+            results = prefetch_rows(results, self.prefetch)
 
         self._results = results
 
@@ -118,7 +294,7 @@ class AsyncCursor(BaseCursor):
     @check_closed
     async def fetchone(self):
         try:
-            return await self.anext()
+            return await self._results.__anext__()
         except StopAsyncIteration:
             return None
 
@@ -127,9 +303,9 @@ class AsyncCursor(BaseCursor):
     async def fetchmany(self, size=None):
         size = size or self.arraysize
         rows = []
-        async for i, row in self._results:
+        async for row in self._results:
             rows.append(row)
-            if i >= size - 1:
+            if len(rows) >= size:
                 break
 
         return rows
@@ -139,6 +315,11 @@ class AsyncCursor(BaseCursor):
     async def fetchall(self):
         return [row async for row in self._results]
 
+    @check_result
+    @check_closed
+    async def fetch_arrow(self):
+        return self._to_arrow([row async for row in self._results])
+
     @check_result
     @check_closed
     def __anext__(self):
@@ -146,69 +327,139 @@ class AsyncCursor(BaseCursor):
 
     anext = __anext__
 
+    @check_result
     @check_closed
     def __aiter__(self):
-        return self
-
-    async def _stream_query(self, query):
-        self.description = None
-
+        # Iterate the results generator directly so that the checks above
+        # run once per loop instead of once per row.
+        return self._results
+
+    async def _open_stream(self, query):
+        """
+        Send a query and read the header of its results.
+
+        Besides the lines that follow the header and the names of the
+        columns, this returns the exit stack holding the response, which must
+        be closed once the lines are read.
+        """
         headers, payload = self._prepare_headers_and_payload(query)
+        self._state = ResultState(payload["resultFormat"])
 
-        http_client = httpx.AsyncClient(
-            headers=headers,
-            verify=self.ssl_verify_cert,
-            cert=self.ssl_client_cert,
-            proxies=self.proxies,
-            timeout=self.timeout,
-        )
+        if self.session is None:
+            self.session = self._own_session = _create_session(
+                self.ssl_verify_cert,
+                self.ssl_client_cert,
+                self.proxies,
+                self.timeout,
+            )
 
-        async with http_client.stream("POST", self.url, json=payload) as response:
-            if response.encoding is None:
-                response.encoding = "utf-8"
+        stack = contextlib.AsyncExitStack()
+        try:
+            response = await stack.enter_async_context(
+                self.session.post(
+                    self.url,
+                    headers=headers,
+                    json=payload,
+                    proxy=_select_proxy(self.proxies, self.url),
+                )
+            )
             # raise any error messages
-            if response.status_code != 200:
-                await response.aread()
-                self._handle_http_error(response)
-
-            # Druid will stream the data in chunks of 8k bytes
-            # setting `chunk_size` to `None` makes it use the server size
-            lines = self._aiter_lines(response, chunk_size=None)
-
-            field_names = ujson_loads(await lines.__anext__())
-            Row = namedtuple("Row", field_names, rename=True)
-            make_row = Row._make
-
-            yield self._set_description(field_names)
-
+            if response.status != 200:
+                self._handle_http_error(await response.text())
+
+            lines = self._aiter_lines(response)
+
+            # an empty response has no columns, and is reported as truncated
+            # once the rows are read
+            field_names = self._parse_header(await _anext(lines, b"[]"))
+            if self._state.result_format == "csv":
+                self._state.converters = self._get_converters(
+                    self._parse_header(await _anext(lines, b""))
+                )
+        except BaseException:
+            await stack.aclose()
+            raise
+
+        return stack, lines, field_names
+
+    async def _iter_rows(self, stack, lines, make_row, state):
+        async with stack:
+            # `csv` values may contain newlines, so lines inside quotes are
+            # neither a trailer nor the end of a batch
+            count_quotes = state.result_format == "csv"
+            in_quotes = False
+
+            # `csv` writes a single empty value as a blank line too, so a blank
+            # line is only the trailer when it is the last one
+            trailer = False
+
+            batch = []
+            batch_size = 0
             async for row in lines:
-                if not row:
+                if trailer:
+                    # the blank line was an empty value, quoted for the parser
+                    trailer = False
+                    batch.append(b'""')
+                    batch_size += 2
+                if not row and not in_quotes:
+                    trailer = True
+                    if count_quotes:
+                        continue
                     break
 
-                yield make_row(ujson_loads(row))
-            else:
+                batch.append(row)
+                batch_size += len(row)
+                if count_quotes and row.count(b'"') % 2:
+                    in_quotes = not in_quotes
+                if in_quotes:
+                    continue
+
+                if len(batch) >= BATCH_MAX_ROWS or batch_size >= BATCH_MAX_BYTES:
+                    for values in self._parse_lines(batch, state):
+                        yield make_row(values)
+                    batch = []
+                    batch_size = 0
+
+            for values in self._parse_lines(batch, state):
+                yield make_row(values)
+            if not trailer:
                 raise ValueError("Truncated response. Trailer line not found.")
 
-    @staticmethod
-    async def _aiter_lines(response, chunk_size=None):
-        # HTTPX aiter_lines implementation is not compatible with requests'
-        # iter_lines implementation
-
-        pending = None
-
-        async for chunk in response.aiter_bytes(chunk_size=chunk_size):
-            if pending is not None:
-                chunk = pending + chunk
+            # read up to the end of the body, so that the connection goes back
+            # to the pool
+            async for _ in lines:
+                pass
+            state.exhausted = True
 
-            lines = chunk.splitlines()
-
-            if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
-                pending = lines.pop()
-            else:
-                pending = None
-
-            for line in lines:
-                yield line
-
-        if pending is not None:
-            yield pending
+    @staticmethod
+    async def _aiter_lines(response):
+        """
+        Split the response body into lines.
+
+        Like `Cursor._iter_lines`, this keeps a single buffer and scans it for
+        newlines with `bytearray.find`. The body is read as the data arrives;
+        `StreamReader.readline` is not used since it limits the line length.
+        """
+        buf = bytearray()
+        async for chunk in response.content.iter_any():
+            # only the new data can hold a newline, which matters for lines
+            # longer than a chunk
+            pos = len(buf)
+            buf += chunk
+            start = 0
+            # slicing the view copies each line once, while slicing the
+            # buffer would copy it into a bytearray first; the view must be
+            # released before the buffer is resized
+            with memoryview(buf) as view:
+                while True:
+                    end = buf.find(b"\n", pos)
+                    if end == -1:
+                        break
+
+                    yield view[start:end].tobytes()
+                    pos = start = end + 1
+
+            del buf[:start]
+
+        if buf:
+            yield bytes(buf)
@@ -2,13 +2,15 @@ import io
 
 from setuptools import find_packages, setup
 
-install_requires = ["requests", "ujson"]
+install_requires = ["ujson", "urllib3"]
 
 extras_require = {
     "pandas": ["pandas"],
-    "async": ["tornado", "httpx"],
+    "async": ["tornado", "aiohttp"],
     "sqlalchemy": ["sqlalchemy"],
     "cli": ["pygments", "prompt_toolkit>=2.0.0", "tabulate"],
+    "orjson": ["orjson"],
+    "pyarrow": ["pyarrow"],
 }
 
 with io.open("README.md", encoding="utf-8") as f:
@@ -1,35 +1,48 @@
-# -*- coding: utf-8 -*-
-from __future__ import unicode_literals
-
+import asyncio
 import json
+import os
+import ssl
 import unittest
 from collections import namedtuple
+from unittest.mock import patch
 
 import tornado.web
 from tornado.testing import AsyncHTTPTestCase, gen_test
 
-from pydruid.db.async_api import AsyncCursor
+from pydruid.db.async_api import (
+    _create_session,
+    async_connect,
+    AsyncCursor,
+    prefetch_rows,
+)
 from pydruid.db.exceptions import ProgrammingError
 
 
 class DruidMockServer(tornado.web.Application):
     mock_response_status_code: int = 200
     mock_response_body: str = ""
+    mock_response_delay: float = 0
     received_request: dict = {}
 
-    def set_mock_response(self, status_code, body):
+    def set_mock_response(self, status_code, body, delay=0):
         self.mock_response_status_code = status_code
         self.mock_response_body = body
+        self.mock_response_delay = delay
 
 
 class DruidSQLHandler(tornado.web.RequestHandler):
-    def post(self):
+    async def post(self):
         self.application.received_request = {
             "headers": dict(self.request.headers),
             "body": self.request.body,
+            "address": self.request.connection.context.address,
         }
         self.set_status(self.application.mock_response_status_code)
         self.write(self.application.mock_response_body)
+        if self.application.mock_response_delay:
+            # send the body, and end it later
+            await self.flush()
+            await asyncio.sleep(self.application.mock_response_delay)
 
 
 class AsyncCursorTestSuite(AsyncHTTPTestCase):
@@ -37,14 +50,15 @@ class AsyncCursorTestSuite(AsyncHTTPTestCase):
         return DruidMockServer(
             [
                 (r"/druid/v2/sql", DruidSQLHandler),
-            ]
+            ],
+            compress_response=True,
         )
 
     def get_sql_endpoint_url(self):
         return f"http://localhost:{self.get_http_port()}/druid/v2/sql"
 
-    def set_mock_response(self, status_code, body):
-        self._app.set_mock_response(status_code, body)
+    def set_mock_response(self, status_code, body, delay=0):
+        self._app.set_mock_response(status_code, body, delay)
 
     def get_received_request(self):
         return self._app.received_request
@@ -60,6 +74,262 @@ class AsyncCursorTestSuite(AsyncHTTPTestCase):
         result = await cursor.fetchall()
         expected = [Row(name="alice"), Row(name="bob"), Row(name="charlie")]
         self.assertEqual(result, expected)
+        await cursor.close()
+
+    @gen_test
+    async def test_iterate(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n["bob"]\n\n')
+        Row = namedtuple("Row", ["name"])
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url())
+        await cursor.execute("SELECT * FROM table")
+        self.assertEqual(await cursor.fetchone(), Row(name="alice"))
+        self.assertEqual([row async for row in cursor], [Row(name="bob")])
+        self.assertIsNone(await cursor.fetchone())
+        await cursor.close()
+
+    @gen_test
+    async def test_use_namedtuples_false(self):
+        self.set_mock_response(200, '["name", "age"]\n["alice", 30]\n\n')
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url(), use_namedtuples=False)
+        await cursor.execute("SELECT * FROM table")
+        result = await cursor.fetchall()
+        self.assertEqual(result, [("alice", 30)])
+        self.assertIs(type(result[0]), tuple)
+        await cursor.close()
+
+    @gen_test
+    async def test_connection_session(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n\n')
+
+        connection = async_connect(
+            "localhost", self.get_http_port(), path="/druid/v2/sql"
+        )
+        for _ in range(2):
+            cursor = connection.cursor()
+            self.assertIs(cursor.session, connection.session)
+            await cursor.execute("SELECT * FROM table")
+            self.assertEqual(await cursor.fetchall(), [("alice",)])
+
+        await connection.close()
+        self.assertTrue(connection.session.closed)
+
+    @gen_test
+    async def test_cursor_session(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n\n')
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url())
+        await cursor.execute("SELECT * FROM table")
+        session = cursor.session
+        await cursor.execute("SELECT * FROM table")
+        self.assertIs(cursor.session, session)
+        self.assertEqual(await cursor.fetchall(), [("alice",)])
+
+        # the session created by the cursor is closed with it, even if the
+        # rows were not read
+        await cursor.execute("SELECT * FROM table")
+        await cursor.close()
+        self.assertTrue(session.closed)
+
+    @gen_test
+    async def test_connection_keep_alive(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n\n', delay=0.1)
+
+        connection = async_connect(
+            "localhost", self.get_http_port(), path="/druid/v2/sql"
+        )
+        addresses = []
+        for _ in range(2):
+            cursor = connection.cursor()
+            await cursor.execute("SELECT * FROM table")
+            self.assertEqual(await cursor.fetchall(), [("alice",)])
+            addresses.append(self.get_received_request()["address"])
+
+        # the body is read to the end, so the connection is reused
+        self.assertEqual(addresses[0], addresses[1])
+        await connection.close()
+
+    @gen_test
+    async def test_connection_context_manager(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n\n')
+
+        connection = async_connect(
+            "localhost", self.get_http_port(), path="/druid/v2/sql"
+        )
+        with self.assertRaises(TypeError):
+            with connection:
+                pass
+        self.assertFalse(connection.closed)
+
+        async with connection as cursor:
+            await cursor.execute("SELECT * FROM table")
+            self.assertEqual(await cursor.fetchall(), [("alice",)])
+        self.assertTrue(connection.closed)
+        self.assertTrue(connection.session.closed)
+
+    @gen_test
+    async def test_connection_verifies_certificates(self):
+        connection = async_connect("localhost", self.get_http_port())
+        connection.cursor()
+        context = connection.session.connector._ssl
+        self.assertIsInstance(context, ssl.SSLContext)
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(context.check_hostname)
+        await connection.close()
+
+    @patch.dict(os.environ, {"https_proxy": "http://proxy:3128", "no_proxy": ""})
+    @gen_test
+    async def test_create_session_environment_proxies(self):
+        session = _create_session(True, None, None, None)
+        self.assertTrue(session.trust_env)
+        await session.close()
+
+        session = _create_session(True, None, {}, None)
+        self.assertFalse(session.trust_env)
+        await session.close()
+
+    @gen_test
+    async def test_prefetch(self):
+        names = ["name{}".format(i) for i in range(1000)]
+        body = "".join('["{}"]\n'.format(name) for name in names)
+        self.set_mock_response(200, '["name"]\n' + body + "\n")
+        Row = namedtuple("Row", ["name"])
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url(), prefetch=512)
+        await cursor.execute("SELECT * FROM table")
+        result = await cursor.fetchall()
+        self.assertEqual(result, [Row(name=name) for name in names])
+        await cursor.close()
+
+    @gen_test
+    async def test_prefetch_closed(self):
+        rows_closed = asyncio.Event()
+
+        async def rows():
+            try:
+                for i in range(10000):
+                    yield (i,)
+            finally:
+                rows_closed.set()
+
+        results = prefetch_rows(rows(), 1)
+        self.assertEqual(await results.__anext__(), (0,))
+        await results.aclose()
+
+        # the producer blocked on the full queue is cancelled, and closes the rows
+        await asyncio.wait_for(rows_closed.wait(), 1)
+
+    @gen_test
+    async def test_prefetch_rows_size(self):
+        read = []
+
+        async def rows():
+            for i in range(1000):
+                read.append(i)
+                yield (i,)
+
+        results = prefetch_rows(rows(), 1)
+        self.assertEqual(await results.__anext__(), (0,))
+        await asyncio.sleep(0.1)
+
+        # the row handed over, a queued one, and one waiting for room
+        self.assertLessEqual(len(read), 3)
+        self.assertEqual(len([row async for row in results]), 999)
+
+    @gen_test
+    async def test_execute_gzip(self):
+        names = ["name{}".format(i) for i in range(1000)]
+        body = "".join('["{}"]\n'.format(name) for name in names)
+        self.set_mock_response(200, '["name"]\n' + body + "\n")
+        Row = namedtuple("Row", ["name"])
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url())
+        await cursor.execute("SELECT * FROM table")
+        result = await cursor.fetchall()
+        self.assertEqual(result, [Row(name=name) for name in names])
+
+        request = self.get_received_request()
+        self.assertIn("gzip", request["headers"]["Accept-Encoding"])
+        await cursor.close()
+
+    @gen_test
+    async def test_prefetch_truncated_response(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n')
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url(), prefetch=512)
+        await cursor.execute("SELECT * FROM table")
+
+        with self.assertRaises(ValueError) as cm:
+            await cursor.fetchall()
+
+        self.assertEqual(
+            cm.exception.args[0], "Truncated response. Trailer line not found."
+        )
+        await cursor.close()
+
+    @gen_test
+    async def test_rowcount(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n["bob"]\n["charlie"]\n\n')
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url())
+        await cursor.execute("SELECT * FROM table")
+        self.assertEqual(await cursor.rowcount, -1)
+        self.assertEqual(len(await cursor.fetchall()), 3)
+        self.assertEqual(await cursor.rowcount, 3)
+        await cursor.close()
+
+    @gen_test
+    async def test_rowcount_previous_results(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n["bob"]\n["charlie"]\n\n')
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url())
+        await cursor.execute("SELECT * FROM table")
+        previous = cursor.__aiter__()
+        self.set_mock_response(200, '["name"]\n["dave"]\n\n')
+        await cursor.execute("SELECT * FROM table")
+
+        # reading the rows of the previous query does not affect the count
+        self.assertEqual(len([row async for row in previous]), 3)
+        self.assertEqual(await cursor.rowcount, -1)
+        self.assertEqual(len(await cursor.fetchall()), 1)
+        self.assertEqual(await cursor.rowcount, 1)
+        await cursor.close()
+
+    @gen_test
+    async def test_fetchmany(self):
+        self.set_mock_response(200, '["name"]\n["alice"]\n["bob"]\n["charlie"]\n\n')
+        Row = namedtuple("Row", ["name"])
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url())
+        await cursor.execute("SELECT * FROM table")
+        self.assertEqual(await cursor.fetchmany(), [Row(name="alice")])
+        self.assertEqual(
+            await cursor.fetchmany(5), [Row(name="bob"), Row(name="charlie")]
+        )
+        self.assertEqual(await cursor.fetchmany(5), [])
+        await cursor.close()
+
+    @gen_test
+    async def test_result_format_csv(self):
+        self.set_mock_response(
+            200, 'name,age\nVARCHAR,BIGINT\nalice,30\n"bob\n\nsmith",\n\n'
+        )
+
+        cursor = AsyncCursor(self.get_sql_endpoint_url(), result_format="csv")
+        await cursor.execute("SELECT * FROM table")
+        self.assertEqual(cursor.description, [("name", None), ("age", None)])
+        result = await cursor.fetchall()
+        self.assertEqual(result, [("alice", 30), ("bob\n\nsmith", None)])
+
+        # an empty value of a single column is written as a blank line
+        self.set_mock_response(200, "name\nVARCHAR\nalice\n\nbob\ncarol\n\n\n")
+        await cursor.execute("SELECT name FROM table")
+        self.assertEqual(
+            await cursor.fetchall(), [("alice",), ("",), ("bob",), ("carol",), ("",)]
+        )
+        self.assertEqual(await cursor.rowcount, 5)
+        await cursor.close()
 
     @gen_test
     async def test_execute_empty_result(self):
@@ -71,6 +341,7 @@ class AsyncCursorTestSuite(AsyncHTTPTestCase):
         result = await cursor.fetchall()
         expected = []
         self.assertEqual(result, expected)
+        await cursor.close()
 
     @gen_test
     async def test_truncated_response(self):
@@ -86,6 +357,21 @@ class AsyncCursorTestSuite(AsyncHTTPTestCase):
         self.assertEqual(
             cm.exception.args[0], "Truncated response. Trailer line not found."
         )
+        await cursor.close()
+
+    @gen_test
+    async def test_aiter_lines(self):
+        class MockStreamReader:
+            async def iter_any(self):
+                body = b'["name"]\n["alice"]\n["bob"]\n\n'
+                for i in range(0, len(body), 3):
+                    yield body[i : i + 3]
+
+        class MockResponse:
+            content = MockStreamReader()
+
+        lines = [line async for line in AsyncCursor._aiter_lines(MockResponse())]
+        self.assertEqual(lines, [b'["name"]', b'["alice"]', b'["bob"]', b""])
 
     @gen_test
     async def test_context(self):
@@ -107,6 +393,7 @@ class AsyncCursorTestSuite(AsyncHTTPTestCase):
                 "resultFormat": "arrayLines",
             },
         )
+        await cursor.close()
 
     @gen_test
     async def test_error(self):
@@ -118,6 +405,7 @@ class AsyncCursorTestSuite(AsyncHTTPTestCase):
             await cursor.execute("SELECT * FROM table")
 
         self.assertEqual(cm.exception.args[0], "Unknown error (Unknown): Some error")
+        await cursor.close()
 
 
 if __name__ == "__main__":